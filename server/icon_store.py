@@ -0,0 +1,303 @@
+"""
+/uploads 下图标的服务层（替代 StaticFiles）。
+
+上传的文件名是 uuid，内容永不改变，因此：
+- 元数据（大小、强 ETag、类型）与小文件内容在首次访问后常驻内存，之后不再 stat 磁盘
+- 响应带 `Cache-Control: immutable`，浏览器在有效期内不再发起校验
+- 支持 If-None-Match / If-Modified-Since、单段 Range、HEAD
+- 可压缩格式（SVG 等）预先生成 `.gz` 旁路文件，按 Accept-Encoding 返回；
+  旁路文件放在 `uploads/.gz/` 下，不在 /uploads 的可访问命名空间内
+"""
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterator, Optional, Tuple
+import gzip, hashlib, mimetypes, os, threading, time
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+COMPRESSIBLE = {".svg", ".json", ".txt", ".xml"}
+MAX_INLINE_BYTES = 256 * 1024          # 小于此大小的文件内容缓存到内存
+MAX_MEMORY_BYTES = 64 * 1024 * 1024    # 内存缓存总预算
+CHUNK = 64 * 1024
+GZ_DIR = ".gz"                         # 旁路文件子目录（以点开头，response 的文件名检查会拒绝）
+MISSING_TTL = 5.0                      # 不存在文件的负缓存时长（秒）
+MAX_MISSING = 4096
+
+class _Variant:
+    __slots__ = ("path", "size", "etag", "data")
+
+    def __init__(self, path: str, size: int, etag: str, data: Optional[bytes]):
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.data = data
+
+class _Entry:
+    __slots__ = ("name", "identity", "gzip", "media_type", "last_modified", "mtime")
+
+    def __init__(self, name, identity, gzip_variant, media_type, mtime):
+        self.name = name
+        self.identity: _Variant = identity
+        self.gzip: Optional[_Variant] = gzip_variant
+        self.media_type = media_type
+        self.mtime = mtime
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
+
+def _digest_file(path: str) -> str:
+    h = hashlib.blake2b(digest_size=12)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """解析单段 `bytes=a-b`；多段或语法错误返回 None（按整文件返回），不可满足抛 ValueError。"""
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    spec = header[6:].strip()
+    start_s, sep, end_s = spec.partition("-")
+    if not sep or not (start_s.isdigit() or start_s == "") or not (end_s.isdigit() or end_s == ""):
+        return None
+    if start_s == "":
+        if end_s == "":
+            return None
+        n = int(end_s)
+        if n == 0:
+            raise ValueError("unsatisfiable")
+        start, end = max(0, size - n), size - 1
+    else:
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    if start >= size or start > end:
+        raise ValueError("unsatisfiable")
+    return start, min(end, size - 1)
+
+class IconStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries: dict = {}
+        # 内存中缓存内容的条目（LRU），用于控制总占用
+        self._resident: "OrderedDict[str, int]" = OrderedDict()
+        self._resident_bytes = 0
+        # 不存在的文件名 -> 过期时间（monotonic），避免对缺失图标反复 stat
+        self._missing: dict = {}
+
+    def _gz_path(self, name: str) -> str:
+        return os.path.join(self.directory, GZ_DIR, name + ".gz")
+
+    # ---- cache management ----
+    def invalidate(self, name: str):
+        with self._lock:
+            self._entries.pop(name, None)
+            self._missing.pop(name, None)
+            size = self._resident.pop(name, None)
+            if size:
+                self._resident_bytes -= size
+
+    def remove(self, name: str):
+        """删除图标及其压缩旁路文件。"""
+        self.invalidate(name)
+        # 同时清掉旧版本放在图标旁边的 .gz
+        for p in (os.path.join(self.directory, name), self._gz_path(name),
+                  os.path.join(self.directory, name + ".gz")):
+            if os.path.exists(p):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def precompress(self, name: str):
+        """上传后立即生成 .gz 旁路文件；不可压缩格式直接跳过。"""
+        with self._lock:
+            self._missing.pop(name, None)
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+            return
+        with open(os.path.join(self.directory, name), "rb") as f:
+            data = f.read()
+        self._write_gzip(name, data)
+
+    def _write_gzip(self, name: str, data: bytes) -> Optional[bytes]:
+        packed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(packed) >= len(data):
+            return None
+        dst = self._gz_path(name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.tmp{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            f.write(packed)
+        os.replace(tmp, dst)
+        return packed
+
+    def _remember(self, name: str, size: int):
+        self._resident[name] = size
+        self._resident_bytes += size
+        while self._resident_bytes > MAX_MEMORY_BYTES and self._resident:
+            old, old_size = self._resident.popitem(last=False)
+            self._resident_bytes -= old_size
+            e = self._entries.get(old)
+            if e is not None:
+                e.identity.data = None
+                if e.gzip is not None:
+                    e.gzip.data = None
+
+    def _load(self, name: str) -> Optional[_Entry]:
+        path = os.path.join(self.directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        ext = os.path.splitext(name)[1].lower()
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if ext == ".svg":
+            media_type = "image/svg+xml"
+
+        data: Optional[bytes] = None
+        if st.st_size <= MAX_INLINE_BYTES:
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = _digest(data)
+        else:
+            digest = _digest_file(path)
+        identity = _Variant(path, st.st_size, f'"{digest}"', data)
+
+        gz_variant = None
+        if ext in COMPRESSIBLE:
+            gz_path = self._gz_path(name)
+            gz_data: Optional[bytes] = None
+            if os.path.exists(gz_path):
+                if os.path.getsize(gz_path) <= MAX_INLINE_BYTES:
+                    with open(gz_path, "rb") as f:
+                        gz_data = f.read()
+            else:
+                raw = data
+                if raw is None:
+                    with open(path, "rb") as f:
+                        raw = f.read()
+                gz_data = self._write_gzip(name, raw)
+                if gz_data is not None and len(gz_data) > MAX_INLINE_BYTES:
+                    gz_data = None
+            if os.path.exists(gz_path):
+                gz_size = os.path.getsize(gz_path)
+                gz_variant = _Variant(gz_path, gz_size, f'"{digest}-gz"', gz_data)
+        return _Entry(name, identity, gz_variant, media_type, st.st_mtime)
+
+    def lookup(self, name: str) -> Optional[_Entry]:
+        e = self._entries.get(name)
+        if e is not None:
+            return e
+        expires = self._missing.get(name)
+        if expires is not None and expires > time.monotonic():
+            return None
+        e = self._load(name)
+        if e is None:
+            with self._lock:
+                if len(self._missing) >= MAX_MISSING:
+                    self._missing.clear()
+                self._missing[name] = time.monotonic() + MISSING_TTL
+            return None
+        with self._lock:
+            self._missing.pop(name, None)
+            if name in self._entries:
+                return self._entries[name]
+            self._entries[name] = e
+            resident = (e.identity.data is not None and len(e.identity.data) or 0) + \
+                       (e.gzip is not None and e.gzip.data is not None and len(e.gzip.data) or 0)
+            if resident:
+                self._remember(name, resident)
+        return e
+
+    # ---- HTTP ----
+    def response(self, request: Request, name: str) -> Response:
+        if not name or name != os.path.basename(name) or name.startswith(".") or "\\" in name:
+            return Response(status_code=404)
+        # 旧版本留在图标旁边的 .gz / .gz.tmp 旁路文件不是图标，不能按原类型长期缓存
+        if name.endswith(".gz") or ".gz.tmp" in name:
+            return Response(status_code=404)
+        e = self.lookup(name)
+        if e is None:
+            return Response(status_code=404)
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+
+        range_header = request.headers.get("range")
+        variant = e.identity
+        headers = {
+            "Cache-Control": CACHE_CONTROL,
+            "Last-Modified": e.last_modified,
+            "Accept-Ranges": "bytes",
+        }
+        if e.gzip is not None:
+            headers["Vary"] = "Accept-Encoding"
+            accept = request.headers.get("accept-encoding", "")
+            if not range_header and "gzip" in accept and "gzip;q=0" not in accept.replace(" ", ""):
+                variant = e.gzip
+                headers["Content-Encoding"] = "gzip"
+        headers["ETag"] = variant.etag
+
+        inm = request.headers.get("if-none-match")
+        if inm is not None:
+            if _etag_matches(inm, variant.etag):
+                return Response(status_code=304, headers=headers)
+        else:
+            ims = request.headers.get("if-modified-since")
+            if ims:
+                try:
+                    if int(e.mtime) <= parsedate_to_datetime(ims).timestamp():
+                        return Response(status_code=304, headers=headers)
+                except (TypeError, ValueError):
+                    pass
+
+        start, end, status = 0, variant.size - 1, 200
+        if range_header and variant is e.identity:
+            if_range = request.headers.get("if-range")
+            if if_range is None or if_range.strip() == variant.etag:
+                try:
+                    rng = _parse_range(range_header, variant.size)
+                except ValueError:
+                    headers["Content-Range"] = f"bytes */{variant.size}"
+                    return Response(status_code=416, headers=headers)
+                if rng is not None:
+                    start, end = rng
+                    status = 206
+                    headers["Content-Range"] = f"bytes {start}-{end}/{variant.size}"
+
+        length = end - start + 1
+        headers["Content-Length"] = str(length)
+        if request.method == "HEAD":
+            return Response(status_code=status, headers=headers, media_type=e.media_type)
+        data = variant.data
+        if data is not None:
+            body = data if status == 200 else data[start:end + 1]
+            return Response(body, status_code=status, headers=headers, media_type=e.media_type)
+        return StreamingResponse(_iter_file(variant.path, start, length), status_code=status,
+                                 headers=headers, media_type=e.media_type)
+
+def _iter_file(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
@@ -0,0 +1,227 @@
+"""
+本地后台任务：长时间的导出/导入放到独立的有界线程池中执行，任务状态持久化在 SQLite 的 job 表。
+
+- 线程池与 FastAPI 处理同步路由用的线程池相互独立，重任务不会占满交互请求的线程
+- 排队数量有上限，超出时 submit 抛 JobQueueFull
+- 进度（已处理条目、已写字节）在内存中实时更新，按间隔节流写回数据库
+- 进程重启时，未完成的任务标记为失败
+- 完成超过 RESULT_TTL 的任务连同结果文件一并删除（启动时及提交新任务时，后者按 CLEANUP_INTERVAL 节流）；
+  没有对应未完成任务的上传文件超过 UPLOAD_GRACE 后也一并删除
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+import os, threading, time, uuid
+
+from sqlmodel import SQLModel, Field, Session, select
+
+import metrics
+
+JOB_DIR = "jobs"
+FLUSH_INTERVAL = 0.5   # 进度写库的最小间隔（秒）
+RESULT_TTL = timedelta(hours=24)
+CLEANUP_INTERVAL = 600.0   # 提交任务时顺带清理的最小间隔（秒）
+UPLOAD_PREFIX = "upload-"
+UPLOAD_GRACE = timedelta(hours=1)   # 上传文件写入后、任务入库前的宽限期
+
+class Job(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    kind: str
+    status: str = "queued"          # queued / running / done / failed
+    scene_id: Optional[int] = None
+    items_done: int = 0
+    items_total: int = 0
+    bytes_written: int = 0
+    input_path: str = ""
+    result_path: str = ""
+    result_scene_id: Optional[int] = None
+    error: str = ""
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class JobQueueFull(Exception):
+    pass
+
+class JobProgress:
+    """传给任务函数的进度对象；任务内部调用 set_total/advance/set_bytes。"""
+
+    def __init__(self, runner: "JobRunner", job_id: str):
+        self._runner = runner
+        self.job_id = job_id
+        self.items_done = 0
+        self.items_total = 0
+        self.bytes_written = 0
+        self._last_flush = 0.0
+
+    def set_total(self, n: int):
+        self.items_total = n
+        self.flush()
+
+    def advance(self, n: int = 1):
+        self.items_done += n
+        self.flush()
+
+    def set_bytes(self, n: int):
+        self.bytes_written = n
+        self.flush()
+
+    def flush(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        self._runner._update(self.job_id, items_done=self.items_done, items_total=self.items_total,
+                             bytes_written=self.bytes_written)
+
+class JobRunner:
+    def __init__(self, engine, max_workers: int = 2, max_pending: int = 16):
+        self.engine = engine
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mcp-job")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._live: Dict[str, JobProgress] = {}
+        self._last_cleanup = 0.0
+        os.makedirs(JOB_DIR, exist_ok=True)
+
+    # ---- lifecycle ----
+    def recover(self):
+        """启动时调用：上次进程退出时未完成的任务无法继续，标记为失败。"""
+        with Session(self.engine) as s:
+            for job in s.exec(select(Job).where(Job.status.in_(["queued", "running"]))).all():
+                job.status = "failed"
+                job.error = "Interrupted by server restart"
+                job.finished_at = datetime.utcnow()
+                self._remove_file(job.input_path)
+                s.add(job)
+            s.commit()
+
+    def cleanup(self, max_age: timedelta = RESULT_TTL):
+        """删除早于 max_age 完成的任务及其结果文件。"""
+        self._last_cleanup = time.monotonic()
+        cutoff = datetime.utcnow() - max_age
+        with Session(self.engine) as s:
+            for job in s.exec(select(Job).where(Job.finished_at != None).where(Job.finished_at < cutoff)).all():  # noqa: E711
+                self._remove_file(job.result_path)
+                s.delete(job)
+            s.commit()
+            live = {os.path.basename(p) for p in s.exec(
+                select(Job.input_path).where(Job.status.in_(["queued", "running"]))).all() if p}
+
+        # 提交失败或写入中断留下的上传文件不会出现在 job 表里，按文件时间清理
+        upload_cutoff = time.time() - UPLOAD_GRACE.total_seconds()
+        try:
+            names = os.listdir(JOB_DIR)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.startswith(UPLOAD_PREFIX) or name in live:
+                continue
+            path = os.path.join(JOB_DIR, name)
+            try:
+                if os.path.getmtime(path) < upload_cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---- submit / query ----
+    def submit(self, kind: str, fn: Callable[[JobProgress], Dict[str, Any]],
+               scene_id: Optional[int] = None, input_path: str = "") -> Job:
+        """fn(progress) 在后台线程执行，返回要写回 Job 的字段（如 result_path / result_scene_id）。"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull()
+            self._pending += 1
+        try:
+            if time.monotonic() - self._last_cleanup >= CLEANUP_INTERVAL:
+                self.cleanup()
+            job = Job(id=uuid.uuid4().hex, kind=kind, scene_id=scene_id, input_path=input_path)
+            with Session(self.engine) as s:
+                s.add(job); s.commit(); s.refresh(job)
+            self._executor.submit(self._run, job.id, kind, fn)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        metrics.JOBS.inc(1, kind, "queued")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with Session(self.engine) as s:
+            job = s.get(Job, job_id)
+        if job is None:
+            return None
+        live = self._live.get(job_id)
+        if live is not None:
+            # 节流写库之间的实时进度
+            job.items_done = live.items_done
+            job.items_total = live.items_total
+            job.bytes_written = live.bytes_written
+        return job
+
+    def list(self, limit: int = 50) -> List[Job]:
+        with Session(self.engine) as s:
+            jobs = s.exec(select(Job).order_by(Job.created_at.desc()).limit(limit)).all()
+        for job in jobs:
+            live = self._live.get(job.id)
+            if live is not None:
+                job.items_done = live.items_done
+                job.items_total = live.items_total
+                job.bytes_written = live.bytes_written
+        return jobs
+
+    def result_path_for(self, job_id: str, suffix: str) -> str:
+        return os.path.join(JOB_DIR, f"{job_id}{suffix}")
+
+    def input_path_for(self, suffix: str) -> str:
+        """任务输入（上传文件）的落盘路径；cleanup 按 UPLOAD_PREFIX 识别遗留文件。"""
+        return os.path.join(JOB_DIR, f"{UPLOAD_PREFIX}{uuid.uuid4().hex}{suffix}")
+
+    # ---- internals ----
+    def _update(self, job_id: str, **fields):
+        with Session(self.engine) as s:
+            job = s.get(Job, job_id)
+            if job is None:
+                return
+            for k, v in fields.items():
+                setattr(job, k, v)
+            s.add(job); s.commit()
+
+    def _run(self, job_id: str, kind: str, fn):
+        progress = JobProgress(self, job_id)
+        self._live[job_id] = progress
+        input_path = ""
+        metrics.JOBS_RUNNING.inc(1, kind)
+        try:
+            with Session(self.engine) as s:
+                job = s.get(Job, job_id)
+                input_path = job.input_path if job else ""
+            self._update(job_id, status="running", started_at=datetime.utcnow())
+            result = fn(progress) or {}
+            progress.flush(force=True)
+            self._update(job_id, status="done", finished_at=datetime.utcnow(), **result)
+            metrics.JOBS.inc(1, kind, "done")
+        except Exception as e:
+            # HTTPException 带 detail，其余异常直接用字符串
+            error = getattr(e, "detail", None) or f"{type(e).__name__}: {e}"
+            progress.flush(force=True)
+            self._update(job_id, status="failed", error=str(error), finished_at=datetime.utcnow())
+            metrics.JOBS.inc(1, kind, "failed")
+        finally:
+            metrics.JOBS_RUNNING.dec(1, kind)
+            self._live.pop(job_id, None)
+            self._remove_file(input_path)
+            with self._lock:
+                self._pending -= 1
+
+    @staticmethod
+    def _remove_file(path: str):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -1,16 +1,23 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 from sqlmodel import SQLModel, Field, Session, create_engine, select
-from typing import Optional, List, Dict, Any, Set
-from pydantic import BaseModel, ConfigDict  # ← 新增 ConfigDict
+from typing import Optional, List, Dict, Any, Set, Tuple, Union, BinaryIO
+from pydantic import BaseModel, ConfigDict, field_validator, model_serializer, model_validator  # ← 新增 ConfigDict
 from datetime import datetime
-import os, shutil, uuid, json, io, zipfile
+import os, shutil, uuid, json, io, zipfile, threading, math
+from collections import OrderedDict
+from sqlalchemy import inspect as sa_inspect, text
 from fastapi.encoders import jsonable_encoder
+import metrics, profiling
+from icon_store import IconStore
+from spatial_index import SpatialIndex, SpatialIndexCache
+from jobs import Job, JobProgress, JobQueueFull, JobRunner
 
 DB_URL = "sqlite:///./mcprogress.db"
 engine = create_engine(DB_URL, echo=False)
+metrics.install_sql_hooks(engine)
+profiling.install_sql_hooks(engine)
 
 # ------------------------------
 # DB MODELS
@@ -27,16 +34,27 @@ class Scene(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = "Default"
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # 场景摘要：保存/导入图时计算，供场景列表直接返回（不必读取图 JSON）
+    node_count: int = 0
+    edge_count: int = 0
+    item_count: int = 0
+    updated_at: Optional[datetime] = None
+    preview_svg: str = ""
 
 class CustomCategory(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True, unique=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# 存储格式：1 = 经 GraphIn 压缩（去掉 ReactFlow 运行时字段、紧凑 JSON）
+GRAPH_FORMAT = 1
+
 class Graph(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     scene_id: int = Field(index=True)
     json: str = "{}"
+    version: int = 0      # 每次保存 +1，用于导出缓存与 ETag
+    format: int = GRAPH_FORMAT
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 # ------------------------------
@@ -68,21 +86,120 @@ class SceneOut(BaseModel):
     id: int
     name: str
     created_at: datetime
+    node_count: int = 0
+    edge_count: int = 0
+    item_count: int = 0
+    updated_at: Optional[datetime] = None
+    preview_svg: str = ""
     # v2 配置
     model_config = ConfigDict(from_attributes=True)
 
+# ---- 图结构 ----
+# 只声明服务端需要的字段，其余样式类字段（style/markerEnd/label...）原样透传；
+# ReactFlow 的运行时状态在校验前剔除，序列化时只输出客户端实际提供的字段。
+_TRANSIENT_NODE_KEYS = ("selected", "dragging", "positionAbsolute", "width", "height", "measured", "resizing")
+_TRANSIENT_EDGE_KEYS = ("selected",)
+
+class _CompactModel(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    @model_serializer(mode="wrap")
+    def _only_set_fields(self, handler):
+        fields_set = self.model_fields_set
+        return {k: v for k, v in handler(self).items() if k in fields_set}
+
+class NodePosition(BaseModel):
+    x: float = 0
+    y: float = 0
+
+    @field_validator("x", "y")
+    @classmethod
+    def _round(cls, v: float):
+        # 亚像素精度没有意义，保留两位小数；整数值存成 int
+        v = round(v, 2)
+        return int(v) if v.is_integer() else v
+
+class GraphNode(_CompactModel):
+    id: Union[str, int]
+    type: Optional[str] = None
+    position: NodePosition = NodePosition()
+    data: Dict[str, Any] = {}
+
+    @model_validator(mode="before")
+    @classmethod
+    def _strip_transient(cls, v):
+        if isinstance(v, dict):
+            v = {k: val for k, val in v.items() if k not in _TRANSIENT_NODE_KEYS}
+            if "data" in v and v["data"] is None:
+                v["data"] = {}
+            # 与 ReactFlow 默认值相同，不必存储
+            for k in ("draggable", "selectable"):
+                if v.get(k) is True:
+                    del v[k]
+        return v
+
+class GraphEdge(_CompactModel):
+    id: Optional[Union[str, int]] = None
+    source: Union[str, int]
+    target: Union[str, int]
+
+    @model_validator(mode="before")
+    @classmethod
+    def _strip_transient(cls, v):
+        if isinstance(v, dict):
+            v = {k: val for k, val in v.items() if k not in _TRANSIENT_EDGE_KEYS}
+        return v
+
 class GraphIn(BaseModel):
-    nodes: List[Dict[str, Any]]
-    edges: List[Dict[str, Any]]
+    nodes: List[GraphNode]
+    edges: List[GraphEdge]
     meta: Dict[str, Any] = {}
 
+    @model_validator(mode="after")
+    def _drop_detail_companions(self):
+        # detailNode 及其 dedge- 连线由 Canvas.tsx 的 ensureDetailCompanions 按 showDetails 重新生成
+        self.nodes = [n for n in self.nodes if n.type != "detailNode"]
+        self.edges = [e for e in self.edges if not str(e.id or "").startswith("dedge-")]
+        return self
+
 class GraphOut(GraphIn):
     scene_id: int
     updated_at: datetime
 
+class LodCell(BaseModel):
+    x: float
+    y: float
+    w: float
+    h: float
+    count: int
+
+class GraphViewportOut(GraphOut):
+    """GET /graph?bbox=... 的响应：视口内的部分图 + 其余节点的聚合。"""
+    partial: bool = True
+    bbox: List[float]
+    bounds: List[float]
+    total_nodes: int
+    total_edges: int
+    lod: List[LodCell] = []
+
 class CategoryCreate(BaseModel):
     name: str
 
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str
+    scene_id: Optional[int] = None
+    items_done: int
+    items_total: int
+    bytes_written: int
+    result_scene_id: Optional[int] = None
+    error: str = ""
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
 # ---- 导出/导入用的模型 ----
 class ExportItem(BaseModel):
     id: int
@@ -103,6 +220,7 @@ class ExportSceneManifest(BaseModel):
 # FastAPI App
 # ------------------------------
 app = FastAPI(title="MC Progress System API")
+app.router.route_class = profiling.ProfiledRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -111,12 +229,90 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+icons = IconStore("uploads")
+job_runner = JobRunner(engine, max_workers=int(os.environ.get("MCP_JOB_WORKERS", "2")))
+
+# create_all 不会给已存在的表补列；新增列在这里登记，启动时用 ALTER TABLE 补齐
+_ADDED_COLUMNS: Dict[str, Dict[str, str]] = {
+    # 已有行补列时 format 取 0，启动时压缩一次
+    "graph": {"version": "INTEGER NOT NULL DEFAULT 0", "format": "INTEGER NOT NULL DEFAULT 0"},
+    "scene": {
+        "node_count": "INTEGER NOT NULL DEFAULT 0",
+        "edge_count": "INTEGER NOT NULL DEFAULT 0",
+        "item_count": "INTEGER NOT NULL DEFAULT 0",
+        "updated_at": "DATETIME",
+        "preview_svg": "VARCHAR NOT NULL DEFAULT ''",
+    },
+}
+
+def _migrate_db():
+    insp = sa_inspect(engine)
+    with engine.begin() as conn:
+        for table, cols in _ADDED_COLUMNS.items():
+            existing = {c["name"] for c in insp.get_columns(table)}
+            for col, ddl in cols.items():
+                if col not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {ddl}"))
+
+def _remove_legacy_exports():
+    # 旧版导出会把 scene_{id}.json 写进 uploads/（可被公开访问），启动时清掉
+    for name in os.listdir("uploads"):
+        if name.startswith("scene_") and name.endswith(".json"):
+            try:
+                os.remove(os.path.join("uploads", name))
+            except OSError:
+                pass
+
+def _compact_graph_json(raw: str) -> Dict[str, Any]:
+    data = json.loads(raw or "{}")
+    if not isinstance(data, dict):
+        data = {}
+    try:
+        return GraphIn(**data).model_dump()
+    except Exception:
+        # 校验不过的旧数据原样保留，只补齐顶层键
+        data.setdefault("nodes", [])
+        data.setdefault("edges", [])
+        if data.get("meta") is None:
+            data["meta"] = {}
+        return data
+
+def _backfill_scene_summaries():
+    with Session(engine) as s:
+        # 升级前保存的图：按 GraphIn 压缩一次，并重算摘要
+        for g in s.exec(select(Graph).where(Graph.format < GRAPH_FORMAT)).all():
+            graph = _compact_graph_json(g.json)
+            g.json = _dump_graph(graph)
+            g.version = (g.version or 0) + 1
+            g.format = GRAPH_FORMAT
+            s.add(g)
+            sc = s.get(Scene, g.scene_id)
+            if sc:
+                _apply_scene_summary(sc, graph, g.updated_at)
+                s.add(sc)
+        s.commit()
+
+        # 升级前保存的场景没有摘要，按现有图补算一次
+        for sc in s.exec(select(Scene).where(Scene.updated_at == None)).all():  # noqa: E711
+            g = s.exec(select(Graph).where(Graph.scene_id == sc.id)).first()
+            if g:
+                _apply_scene_summary(sc, json.loads(g.json), g.updated_at)
+            else:
+                # 还没有图的场景记为空摘要，避免每次启动都重新查询
+                _apply_scene_summary(sc, {}, sc.created_at)
+            s.add(sc)
+        s.commit()
 
 def init_db():
     SQLModel.metadata.create_all(engine)
+    _migrate_db()
+    _remove_legacy_exports()
+    _backfill_scene_summaries()
     # Seed default scene and a few starter items if empty
     with Session(engine) as s:
         if not s.exec(select(Scene)).first():
@@ -138,6 +334,12 @@ def init_db():
 @app.on_event("startup")
 def on_start():
     init_db()
+    job_runner.recover()
+    job_runner.cleanup()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    job_runner.shutdown()
 
 # ------------------------------
 # Helpers
@@ -148,6 +350,67 @@ def _get_scene_or_404(s: Session, scene_id: int) -> Scene:
         raise HTTPException(status_code=404, detail="Scene not found")
     return sc
 
+# 场景 JSON 导出缓存：scene_id -> (graph 版本键, 编码后的字节)，按条数和总字节数双重限制
+_EXPORT_CACHE_SIZE = 32
+_EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_export_cache: "OrderedDict[int, Tuple[Tuple[int, int, str], bytes]]" = OrderedDict()
+_export_cache_bytes = 0
+_export_cache_lock = threading.Lock()
+
+def _export_cache_get(scene_id: int, key: Tuple[int, int, str]) -> Optional[bytes]:
+    with _export_cache_lock:
+        hit = _export_cache.get(scene_id)
+        if hit is None or hit[0] != key:
+            return None
+        _export_cache.move_to_end(scene_id)
+        return hit[1]
+
+def _export_cache_put(scene_id: int, key: Tuple[int, int, str], body: bytes):
+    global _export_cache_bytes
+    with _export_cache_lock:
+        old = _export_cache.pop(scene_id, None)
+        if old is not None:
+            _export_cache_bytes -= len(old[1])
+        if len(body) > _EXPORT_CACHE_MAX_BYTES:
+            return
+        _export_cache[scene_id] = (key, body)
+        _export_cache_bytes += len(body)
+        while len(_export_cache) > _EXPORT_CACHE_SIZE or _export_cache_bytes > _EXPORT_CACHE_MAX_BYTES:
+            _, (_, evicted) = _export_cache.popitem(last=False)
+            _export_cache_bytes -= len(evicted)
+
+def _export_cache_drop(scene_id: int):
+    global _export_cache_bytes
+    with _export_cache_lock:
+        old = _export_cache.pop(scene_id, None)
+        if old is not None:
+            _export_cache_bytes -= len(old[1])
+
+# 视口查询用的空间索引，同样按图版本缓存
+spatial_indexes = SpatialIndexCache()
+
+def _graph_key(graph_id: int, version: int, updated_at: datetime) -> Tuple[int, int, str]:
+    return (graph_id, version, updated_at.isoformat())
+
+def _parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    try:
+        x0, y0, x1, y1 = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be x0,y0,x1,y1")
+    if not all(math.isfinite(v) for v in (x0, y0, x1, y1)):
+        raise HTTPException(status_code=400, detail="bbox values must be finite numbers")
+    return x0, y0, x1, y1
+
+def _dump_graph(graph: Dict[str, Any]) -> str:
+    return json.dumps(graph, ensure_ascii=False, separators=(",", ":"))
+
+def _graph_response(scene_id: int, updated_at: datetime, graph_json: str) -> Response:
+    # 已存储的图 JSON 直接拼进响应，不再 loads + 逐节点校验 + 再序列化
+    head = json.dumps({"scene_id": scene_id, "updated_at": updated_at.isoformat()}, separators=(",", ":"))
+    body = graph_json.strip()
+    rest = "}" if body == "{}" else "," + body[1:]
+    return Response(head[:-1] + rest, media_type="application/json")
+
 def _collect_item_ids_from_graph(graph: Dict[str, Any]) -> Set[int]:
     ids: Set[int] = set()
     for n in graph.get("nodes", []):
@@ -161,6 +424,81 @@ def _collect_item_ids_from_graph(graph: Dict[str, Any]) -> Set[int]:
             ids.add(data["item"]["id"])
     return ids
 
+PREVIEW_W, PREVIEW_H = 160, 90
+PREVIEW_MAX_NODES = 200
+PREVIEW_MAX_EDGES = 300
+
+def _render_preview_svg(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> str:
+    """把节点位置缩放到 160x90 的小缩略图；节点与连线各合并为一条 path，控制体积。"""
+    pos: Dict[str, Tuple[float, float]] = {}
+    for n in nodes:
+        p = n.get("position") or {}
+        x, y = p.get("x"), p.get("y")
+        if isinstance(x, (int, float)) and isinstance(y, (int, float)):
+            pos[str(n.get("id"))] = (float(x), float(y))
+    if not pos:
+        return ""
+    xs = [p[0] for p in pos.values()]
+    ys = [p[1] for p in pos.values()]
+    min_x, min_y = min(xs), min(ys)
+    # 四周留 4px；节点方块本身占 3px，包含在边距内
+    scale = min((PREVIEW_W - 8) / max(max(xs) - min_x, 1.0),
+                (PREVIEW_H - 8) / max(max(ys) - min_y, 1.0))
+
+    def pt(p: Tuple[float, float]) -> Tuple[int, int]:
+        return round(4 + (p[0] - min_x) * scale), round(4 + (p[1] - min_y) * scale)
+
+    ids = list(pos)
+    if len(ids) > PREVIEW_MAX_NODES:
+        step = len(ids) / PREVIEW_MAX_NODES
+        ids = [ids[int(i * step)] for i in range(PREVIEW_MAX_NODES)]
+    node_path = "".join("M{} {}h3v3h-3z".format(*pt(pos[i])) for i in ids)
+
+    segs = []
+    for e in edges:
+        a, b = pos.get(str(e.get("source"))), pos.get(str(e.get("target")))
+        if a and b:
+            (x1, y1), (x2, y2) = pt(a), pt(b)
+            segs.append(f"M{x1 + 1} {y1 + 1}L{x2 + 1} {y2 + 1}")
+            if len(segs) >= PREVIEW_MAX_EDGES:
+                break
+    edge_path = "".join(segs)
+
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {PREVIEW_W} {PREVIEW_H}">'
+            + (f'<path d="{edge_path}" stroke="#888" stroke-width="0.6" fill="none"/>' if edge_path else "")
+            + f'<path d="{node_path}" fill="#5b8"/></svg>')
+
+def _apply_scene_summary(sc: Scene, graph: Dict[str, Any], updated_at: datetime):
+    # detailNode / dedge- 是前端按 showDetails 生成的伴随元素，不计入统计
+    nodes = [n for n in graph.get("nodes", []) if n.get("type") != "detailNode"]
+    edges = [e for e in graph.get("edges", []) if not str(e.get("id", "")).startswith("dedge-")]
+    sc.node_count = len(nodes)
+    sc.edge_count = len(edges)
+    sc.item_count = len(_collect_item_ids_from_graph({"nodes": nodes}))
+    sc.updated_at = updated_at
+    sc.preview_svg = _render_preview_svg(nodes, edges)
+
+# ------------------------------
+# Metrics
+# ------------------------------
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+# ------------------------------
+# Profiling (MCP_PROFILE=1)
+# ------------------------------
+@app.get("/api/admin/profiles")
+def list_profiles():
+    return {"enabled": profiling.ENABLED, "slow_ms": profiling.SLOW_MS, "profiles": profiling.list_profiles()}
+
+@app.get("/api/admin/profiles/{profile_id}")
+def get_profile(profile_id: str):
+    p = profiling.get_profile(profile_id)
+    if not p:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return p
+
 # ------------------------------
 # Items
 # ------------------------------
@@ -205,13 +543,8 @@ def delete_item(item_id: int):
         if not item:
             raise HTTPException(status_code=404, detail="Item not found")
         # Optionally remove icon file
-        if item.icon_path:
-            p = os.path.join(os.getcwd(), item.icon_path.lstrip("/"))
-            if os.path.exists(p):
-                try:
-                    os.remove(p)
-                except Exception:
-                    pass
+        if item.icon_path and item.icon_path.startswith("/uploads/"):
+            icons.remove(os.path.basename(item.icon_path))
         s.delete(item)
         s.commit()
         return {"ok": True}
@@ -265,6 +598,8 @@ def upload_icon(file: UploadFile = File(...), name: Optional[str] = Form(None),
     dest = os.path.join("uploads", newname)
     with open(dest, "wb") as f:
         shutil.copyfileobj(file.file, f)
+    metrics.UPLOAD_BYTES.inc(os.path.getsize(dest), "icon")
+    icons.precompress(newname)
     icon_url = f"/uploads/{newname}"
     if name:
         # create an item tied to this icon
@@ -276,6 +611,10 @@ def upload_icon(file: UploadFile = File(...), name: Optional[str] = Form(None),
             return {"icon_url": icon_url, "item": ItemOut.from_orm(item)}
     return {"icon_url": icon_url}
 
+@app.api_route("/uploads/{name}", methods=["GET", "HEAD"], include_in_schema=False)
+def serve_upload(name: str, request: Request):
+    return icons.response(request, name)
+
 # ------------------------------
 # Scenes / Graph
 # ------------------------------
@@ -323,31 +662,59 @@ def delete_scene(scene_id: int):
             s.delete(graph)
         s.delete(scene)
         s.commit()
+        _export_cache_drop(scene_id)
+        spatial_indexes.drop(scene_id)
         return {"ok": True}
 
-@app.get("/api/scenes/{scene_id}/graph", response_model=GraphOut)
-def get_graph(scene_id: int):
+@app.get("/api/scenes/{scene_id}/graph", response_model=Union[GraphOut, GraphViewportOut])
+def get_graph(scene_id: int, bbox: Optional[str] = None):
+    """bbox=x0,y0,x1,y1 时只返回视口内的节点、关联边和其余部分的聚合（partial=true）。"""
     with Session(engine) as s:
         _get_scene_or_404(s, scene_id)
+        if bbox is not None:
+            return _get_graph_viewport(s, scene_id, _parse_bbox(bbox))
         g = s.exec(select(Graph).where(Graph.scene_id == scene_id)).first()
         if not g:
-            g = Graph(scene_id=scene_id, json=json.dumps({"nodes": [], "edges": [], "meta": {}}))
+            g = Graph(scene_id=scene_id, json=_dump_graph({"nodes": [], "edges": [], "meta": {}}))
             s.add(g); s.commit(); s.refresh(g)
-        data = json.loads(g.json)
-        return GraphOut(scene_id=scene_id, updated_at=g.updated_at, **data)
+        resp = _graph_response(scene_id, g.updated_at, g.json)
+        # 用已编码的响应体长度（含 scene_id/updated_at 头部几十字节），不再额外编码一次
+        metrics.GRAPH_JSON_BYTES.observe(len(resp.body), "get")
+        return resp
+
+def _get_graph_viewport(s: Session, scene_id: int, box: Tuple[float, float, float, float]) -> Response:
+    row = s.exec(select(Graph.id, Graph.version, Graph.updated_at).where(Graph.scene_id == scene_id)).first()
+    if not row:
+        index, updated_at = SpatialIndex({}), datetime.utcnow()
+    else:
+        key = _graph_key(*row)
+        updated_at = row[2]
+        index = spatial_indexes.get(scene_id, key)
+        if index is None:
+            g_json = s.exec(select(Graph.json).where(Graph.id == row[0])).first()
+            index = SpatialIndex(json.loads(g_json or "{}"))
+            spatial_indexes.put(scene_id, key, index)
+    out = index.query(*box)
+    out["scene_id"] = scene_id
+    out["updated_at"] = updated_at.isoformat()
+    return Response(_dump_graph(out), media_type="application/json")
 
 @app.put("/api/scenes/{scene_id}/graph", response_model=GraphOut)
 def put_graph(scene_id: int, payload: GraphIn):
     with Session(engine) as s:
-        _get_scene_or_404(s, scene_id)
+        sc = _get_scene_or_404(s, scene_id)
         g = s.exec(select(Graph).where(Graph.scene_id == scene_id)).first()
         if not g:
             g = Graph(scene_id=scene_id)
-        g.json = json.dumps(payload.dict())
+        graph = payload.model_dump()
+        g.json = _dump_graph(graph)
+        metrics.GRAPH_JSON_BYTES.observe(len(g.json.encode("utf-8")), "put")
+        g.version = (g.version or 0) + 1
         g.updated_at = datetime.utcnow()
-        s.add(g); s.commit(); s.refresh(g)
-        data = json.loads(g.json)
-        return GraphOut(scene_id=scene_id, updated_at=g.updated_at, **data)
+        _apply_scene_summary(sc, graph, g.updated_at)
+        s.add(g); s.add(sc); s.commit(); s.refresh(g)
+        spatial_indexes.put(scene_id, _graph_key(g.id, g.version, g.updated_at), SpatialIndex(graph))
+        return _graph_response(scene_id, g.updated_at, g.json)
 
 @app.get("/api/edge-styles")
 def edge_styles():
@@ -359,21 +726,35 @@ def edge_styles():
     ]
 
 @app.get("/api/export/scene/{scene_id}.json")
-def export_scene_json(scene_id: int):
+def export_scene_json(scene_id: int, request: Request):
     with Session(engine) as s:
-        g = s.exec(select(Graph).where(Graph.scene_id == scene_id)).first()
-        if not g:
+        # 先只取版本信息：命中缓存或 304 时不读取图 JSON
+        row = s.exec(select(Graph.id, Graph.version, Graph.updated_at).where(Graph.scene_id == scene_id)).first()
+        if not row:
             raise HTTPException(status_code=404, detail="Graph not found")
-        path = f"uploads/scene_{scene_id}.json"
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(g.json)
-        return FileResponse(path, filename=os.path.basename(path), media_type="application/json")
+        key = _graph_key(row[0], row[1], row[2])
+        etag = f'"scene-{scene_id}-{row[0]}-{row[1]}-{int(row[2].timestamp() * 1000)}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "Content-Disposition": f'attachment; filename="scene_{scene_id}.json"',
+        }
+        inm = request.headers.get("if-none-match")
+        if inm and etag in [t.strip().removeprefix("W/") for t in inm.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        body = _export_cache_get(scene_id, key)
+        if body is None:
+            g_json = s.exec(select(Graph.json).where(Graph.id == row[0])).first()
+            body = (g_json or "{}").encode("utf-8")
+            _export_cache_put(scene_id, key, body)
+        metrics.EXPORT_BYTES.inc(len(body), "json")
+        return Response(body, media_type="application/json", headers=headers)
 
 # ------------------------------
 # NEW: Export ZIP and Import ZIP
 # ------------------------------
-@app.get("/api/export/scene/{scene_id}.zip")
-def export_scene_zip(scene_id: int):
+def _write_scene_zip(scene_id: int, out: BinaryIO, progress: Optional[JobProgress] = None):
     with Session(engine) as s:
         sc = _get_scene_or_404(s, scene_id)
         grow = s.exec(select(Graph).where(Graph.scene_id == scene_id)).first()
@@ -391,50 +772,57 @@ def export_scene_zip(scene_id: int):
         cats = s.exec(select(CustomCategory)).all()
         cat_names = [c.name for c in cats]
 
-        manifest = ExportSceneManifest(
-            scene=SceneOut.from_orm(sc),
-            graph=GraphIn(**graph_data),
-            categories=cat_names,
-            items=[ExportItem(id=i.id, name=i.name, category=i.category,
-                              description=i.description, icon_path=i.icon_path) for i in items],
-            notes={"exported_at": datetime.utcnow().isoformat()},
-        )
-
-        buf = io.BytesIO()
-        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
-            # 写 manifest.json（兼容 pydantic v1/v2）
-            try:
-                manifest_dict = manifest.model_dump()   # pydantic v2
-            except AttributeError:
-                manifest_dict = manifest.dict()         # pydantic v1
-
-            # 用 jsonable_encoder 处理 pydantic 模型与 datetime
-            manifest_json = json.dumps(jsonable_encoder(manifest), indent=2, ensure_ascii=False)
-            z.writestr("manifest.json", manifest_json)
-
-            # 复制图标文件到 icons/
-            for it in items:
-                if it.icon_path and it.icon_path.startswith("/uploads/"):
-                    abs_path = os.path.join(os.getcwd(), it.icon_path.lstrip("/"))
-                    if os.path.exists(abs_path):
-                        z.write(abs_path, arcname=f"icons/{os.path.basename(abs_path)}")
-
-        buf.seek(0)
-        filename = f"scene_{scene_id}.zip"
-        return StreamingResponse(buf, media_type="application/zip", headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
-        })
-
-@app.post("/api/import/scene")
-def import_scene(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".zip"):
-        raise HTTPException(status_code=400, detail="Please upload a .zip")
-
-    raw = file.file.read()
-    bio = io.BytesIO(raw)
+        # 与 ExportSceneManifest 同结构；图直接取已存储的 dict，不再重新校验
+        manifest = {
+            "version": ExportSceneManifest.model_fields["version"].default,
+            "scene": SceneOut.from_orm(sc),
+            "graph": {
+                "nodes": graph_data.get("nodes") or [],
+                "edges": graph_data.get("edges") or [],
+                "meta": graph_data.get("meta") or {},
+            },
+            "categories": cat_names,
+            "items": [ExportItem(id=i.id, name=i.name, category=i.category,
+                                 description=i.description, icon_path=i.icon_path) for i in items],
+            "notes": {"exported_at": datetime.utcnow().isoformat()},
+        }
+
+    if progress:
+        progress.set_total(len(items) + 1)
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+        # 用 jsonable_encoder 处理 pydantic 模型与 datetime
+        manifest_json = json.dumps(jsonable_encoder(manifest), indent=2, ensure_ascii=False)
+        z.writestr("manifest.json", manifest_json)
+        if progress:
+            progress.advance()
+            progress.set_bytes(out.tell())
+
+        # 复制图标文件到 icons/
+        for it in items:
+            if it.icon_path and it.icon_path.startswith("/uploads/"):
+                abs_path = os.path.join(os.getcwd(), it.icon_path.lstrip("/"))
+                if os.path.exists(abs_path):
+                    z.write(abs_path, arcname=f"icons/{os.path.basename(abs_path)}")
+            if progress:
+                progress.advance()
+                progress.set_bytes(out.tell())
+    if progress:
+        progress.set_bytes(out.tell())
+    metrics.EXPORT_BYTES.inc(out.tell(), "zip")
 
+@app.get("/api/export/scene/{scene_id}.zip")
+def export_scene_zip(scene_id: int):
+    buf = io.BytesIO()
+    _write_scene_zip(scene_id, buf)
+    buf.seek(0)
+    filename = f"scene_{scene_id}.zip"
+    return StreamingResponse(buf, media_type="application/zip", headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+def _import_scene_zip(src: BinaryIO, progress: Optional[JobProgress] = None) -> int:
     # 在 with 作用域内完成：读取 manifest、复制图标、写 DB
-    with zipfile.ZipFile(bio, "r") as z:
+    with zipfile.ZipFile(src, "r") as z:
         if "manifest.json" not in z.namelist():
             raise HTTPException(status_code=400, detail="manifest.json not found")
         manifest_data = json.loads(z.read("manifest.json").decode("utf-8"))
@@ -443,6 +831,8 @@ def import_scene(file: UploadFile = File(...)):
             m = ExportSceneManifest(**manifest_data)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Bad manifest: {e}")
+        if progress:
+            progress.set_total(len(m.items) + 1)
 
         with Session(engine) as s:
             # 1) 新场景
@@ -457,6 +847,7 @@ def import_scene(file: UploadFile = File(...)):
 
             # 3) 物品导入 + 图标复制 + 去重（name+category）
             old_to_new: Dict[int, int] = {}
+            written = 0
             for it in m.items:
                 exists = s.exec(
                     select(Item).where(Item.name == it.name).where(Item.category == it.category)
@@ -469,8 +860,10 @@ def import_scene(file: UploadFile = File(...)):
                     if icon_entry in z.namelist():
                         newname = f"{uuid.uuid4().hex}{os.path.splitext(basename)[1].lower()}"
                         dst = os.path.join("uploads", newname)
-                        with z.open(icon_entry) as src, open(dst, "wb") as out:
-                            shutil.copyfileobj(src, out)
+                        with z.open(icon_entry) as src_icon, open(dst, "wb") as out:
+                            shutil.copyfileobj(src_icon, out)
+                            written += out.tell()
+                        icons.precompress(newname)
                         icon_path = f"/uploads/{newname}"
 
                 if exists:
@@ -486,6 +879,9 @@ def import_scene(file: UploadFile = File(...)):
                     )
                     s.add(new_item); s.commit(); s.refresh(new_item)
                     old_to_new[it.id] = new_item.id
+                if progress:
+                    progress.advance()
+                    progress.set_bytes(written)
 
             # 4) 重写 graph 里的 itemId / item_id / item.id
             try:
@@ -507,8 +903,104 @@ def import_scene(file: UploadFile = File(...)):
 
             # 5) 保存图
             g = Graph(scene_id=new_scene.id,
-                      json=json.dumps(graph_obj, ensure_ascii=False),
-                      updated_at=datetime.utcnow())
-            s.add(g); s.commit()
+                      json=_dump_graph(graph_obj),
+                      version=1, updated_at=datetime.utcnow())
+            _apply_scene_summary(new_scene, graph_obj, g.updated_at)
+            s.add(g); s.add(new_scene); s.commit(); s.refresh(g)
+            spatial_indexes.put(new_scene.id, _graph_key(g.id, g.version, g.updated_at), SpatialIndex(graph_obj))
+            if progress:
+                progress.advance()
+                progress.set_bytes(written + len(g.json))
+
+            return new_scene.id
 
-            return {"ok": True, "scene_id": new_scene.id}
\ No newline at end of file
+@app.post("/api/import/scene")
+def import_scene(file: UploadFile = File(...)):
+    if not file.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="Please upload a .zip")
+
+    raw = file.file.read()
+    metrics.UPLOAD_BYTES.inc(len(raw), "import")
+    scene_id = _import_scene_zip(io.BytesIO(raw))
+    return {"ok": True, "scene_id": scene_id}
+
+# ------------------------------
+# Background jobs（大场景导出/导入，轮询进度）
+# ------------------------------
+def _remove_job_input(input_path: str):
+    if input_path and os.path.exists(input_path):
+        os.remove(input_path)
+
+def _submit_job(kind: str, fn, scene_id: Optional[int] = None, input_path: str = "") -> Job:
+    # 未能入队的任务不会再有人删除它的输入文件，这里就地清理
+    try:
+        return job_runner.submit(kind, fn, scene_id=scene_id, input_path=input_path)
+    except JobQueueFull:
+        _remove_job_input(input_path)
+        raise HTTPException(status_code=429, detail="Too many pending jobs")
+    except Exception:
+        _remove_job_input(input_path)
+        raise
+
+@app.post("/api/jobs/export/scene/{scene_id}", response_model=JobOut, status_code=202)
+def submit_export_job(scene_id: int):
+    with Session(engine) as s:
+        _get_scene_or_404(s, scene_id)
+
+    def run(progress: JobProgress) -> Dict[str, Any]:
+        path = job_runner.result_path_for(progress.job_id, ".zip")
+        try:
+            with open(path, "wb") as out:
+                _write_scene_zip(scene_id, out, progress)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return {"result_path": path}
+
+    return _submit_job("export_scene", run, scene_id=scene_id)
+
+@app.post("/api/jobs/import/scene", response_model=JobOut, status_code=202)
+def submit_import_job(file: UploadFile = File(...)):
+    if not file.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="Please upload a .zip")
+    # 上传内容先落盘，任务线程从文件读取，不在内存里保留整个包
+    input_path = job_runner.input_path_for(".zip")
+    try:
+        with open(input_path, "wb") as f:
+            shutil.copyfileobj(file.file, f)
+            metrics.UPLOAD_BYTES.inc(f.tell(), "import")
+    except Exception:
+        _remove_job_input(input_path)
+        raise
+
+    def run(progress: JobProgress) -> Dict[str, Any]:
+        with open(input_path, "rb") as src:
+            return {"result_scene_id": _import_scene_zip(src, progress)}
+
+    return _submit_job("import_scene", run, input_path=input_path)
+
+@app.get("/api/jobs", response_model=List[JobOut])
+def list_jobs(limit: int = 50):
+    return job_runner.list(limit=min(max(limit, 1), 200))
+
+@app.get("/api/jobs/{job_id}", response_model=JobOut)
+def get_job(job_id: str):
+    job = job_runner.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_runner.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if job.kind == "import_scene":
+        return {"ok": True, "scene_id": job.result_scene_id}
+    if not job.result_path or not os.path.exists(job.result_path):
+        raise HTTPException(status_code=410, detail="Job result expired")
+    return FileResponse(job.result_path, media_type="application/zip",
+                        filename=f"scene_{job.scene_id}.zip")
@@ -0,0 +1,251 @@
+"""
+进程内轻量指标（Prometheus 文本格式），由 main.py 挂载到 /metrics。
+
+- 不依赖 prometheus_client；每个指标一把锁，observe/inc 只做几次 dict 查找与加法
+- 路由标签使用路由模板（/api/scenes/{scene_id}/graph），避免按具体 URL 膨胀
+- 每个请求的 DB 查询数/耗时通过 contextvar 归属到所在路由
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+import threading, time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ------------------------------
+# Metric types
+# ------------------------------
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = self._header()
+        for lv, v in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, lv)} {_fmt(v)}")
+        return lines
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, *labels: str):
+        self.inc(-amount, *labels)
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [每个桶的（非累计）计数..., +Inf 计数, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[idx] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(lv, list(row)) for lv, row in self._values.items()]
+        lines = self._header()
+        for lv, row in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                acc += n
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, lv, le)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, lv)} {_fmt(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, lv)} {acc}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, m):
+        self._metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# ------------------------------
+# Metrics
+# ------------------------------
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "mcp_http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "mcp_http_request_duration_seconds", "HTTP request latency.", ("route", "method")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "mcp_http_requests_in_flight", "HTTP requests currently being served."))
+HTTP_REQUEST_BYTES = REGISTRY.register(Histogram(
+    "mcp_http_request_bytes", "HTTP request body size.", ("route", "method"), SIZE_BUCKETS))
+HTTP_RESPONSE_BYTES = REGISTRY.register(Histogram(
+    "mcp_http_response_bytes", "HTTP response body size.", ("route", "method"), SIZE_BUCKETS))
+DB_QUERIES = REGISTRY.register(Counter(
+    "mcp_db_queries_total", "SQL statements executed, attributed to the HTTP route.", ("route",)))
+DB_QUERY_SECONDS = REGISTRY.register(Counter(
+    "mcp_db_query_seconds_total", "Time spent executing SQL statements.", ("route",)))
+DB_QUERIES_PER_REQUEST = REGISTRY.register(Histogram(
+    "mcp_db_queries_per_request", "SQL statements executed per HTTP request.", ("route",), COUNT_BUCKETS))
+GRAPH_JSON_BYTES = REGISTRY.register(Histogram(
+    "mcp_graph_json_bytes", "Size of stored graph JSON by operation.", ("op",), SIZE_BUCKETS))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    "mcp_upload_bytes_total", "Bytes received as uploaded files.", ("kind",)))
+EXPORT_BYTES = REGISTRY.register(Counter(
+    "mcp_export_bytes_total", "Bytes produced by scene exports.", ("format",)))
+JOBS = REGISTRY.register(Counter(
+    "mcp_jobs_total", "Background jobs by kind and state transition.", ("kind", "status")))
+JOBS_RUNNING = REGISTRY.register(Gauge(
+    "mcp_jobs_running", "Background jobs currently executing.", ("kind",)))
+
+# ------------------------------
+# Request / DB instrumentation
+# ------------------------------
+class _RequestStats:
+    __slots__ = ("queries", "query_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+# 由中间件在请求开始时设置；同步路由在线程池中运行时 contextvar 会被复制过去
+_current: ContextVar[Optional[_RequestStats]] = ContextVar("mcp_request_stats", default=None)
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        return getattr(endpoint, "__name__", "<endpoint>")
+    return "<unmatched>"
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：统计延迟、状态码、请求/响应字节数和每请求的 SQL 次数。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = _RequestStats()
+        token = _current.set(stats)
+        req_bytes = 0
+        resp_bytes = 0
+        status = 500
+
+        async def receive_wrapper():
+            nonlocal req_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                req_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal resp_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                resp_bytes += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            _current.reset(token)
+            route = _route_label(scope)
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(1, route, method, str(status))
+            HTTP_LATENCY.observe(elapsed, route, method)
+            HTTP_REQUEST_BYTES.observe(req_bytes, route, method)
+            HTTP_RESPONSE_BYTES.observe(resp_bytes, route, method)
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, route)
+            if stats.queries:
+                DB_QUERIES.inc(stats.queries, route)
+                DB_QUERY_SECONDS.inc(stats.query_seconds, route)
+
+def install_sql_hooks(engine):
+    """在 engine 上注册 SQL 计时钩子，把查询次数和耗时记到当前请求。"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("mcp_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("mcp_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats = _current.get()
+        if stats is None:
+            # 启动阶段等非请求上下文
+            DB_QUERIES.inc(1, "<background>")
+            DB_QUERY_SECONDS.inc(elapsed, "<background>")
+            return
+        stats.queries += 1
+        stats.query_seconds += elapsed
@@ -0,0 +1,313 @@
+"""
+按需开启的请求剖析：记录每个请求的 SQL 语句与耗时、标记重复查询（N+1），
+并对慢请求采样 Python 调用栈。默认关闭，关闭时不注册任何钩子/中间件。
+
+环境变量：
+- MCP_PROFILE=1            开启
+- MCP_PROFILE_SLOW_MS      慢请求阈值（毫秒，默认 1000），超过即保存剖析结果
+- MCP_PROFILE_SAMPLE_MS    栈采样间隔（毫秒，默认 10）
+- MCP_PROFILE_REPEAT       同一语句在单个请求中执行多少次视为 N+1（默认 5）
+- MCP_PROFILE_KEEP         内存中保留的剖析结果数量（默认 50）
+- MCP_PROFILE_DIR          若设置，剖析结果同时写入该目录下的 {id}.json（由后台线程写入，不阻塞事件循环）
+
+请求头 `X-Profile: 1` 可强制保存该请求的剖析结果（不论快慢）。
+"""
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+import functools, inspect, json, os, queue, sys, threading, time, uuid
+
+from fastapi.routing import APIRoute
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+ENABLED = os.environ.get("MCP_PROFILE", "").lower() in ("1", "true", "yes", "on")
+SLOW_MS = _env_int("MCP_PROFILE_SLOW_MS", 1000)
+SAMPLE_MS = max(1, _env_int("MCP_PROFILE_SAMPLE_MS", 10))
+REPEAT_THRESHOLD = _env_int("MCP_PROFILE_REPEAT", 5)
+KEEP = _env_int("MCP_PROFILE_KEEP", 50)
+PROFILE_DIR = os.environ.get("MCP_PROFILE_DIR", "")
+
+MAX_QUERIES = 5000      # 单请求最多保留的语句明细（计数不受限）
+MAX_SQL_CHARS = 2000
+MAX_STACK_DEPTH = 64
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = {os.path.abspath(__file__), os.path.join(_APP_DIR, "metrics.py")}
+
+# ------------------------------
+# Per-request profile
+# ------------------------------
+class RequestProfile:
+    def __init__(self, method: str, path: str, forced: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.route = ""
+        self.status = 0
+        self.forced = forced
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.duration_ms = 0.0
+        self.query_count = 0
+        self.query_ms = 0.0
+        self.queries: List[Dict[str, Any]] = []
+        self.threads: Set[int] = set()
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._lock = threading.Lock()
+
+    def add_query(self, statement: str, elapsed: float, caller: str):
+        at_ms = (time.perf_counter() - self.start) * 1000
+        with self._lock:
+            self.query_count += 1
+            self.query_ms += elapsed * 1000
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({
+                    "sql": statement[:MAX_SQL_CHARS],
+                    "ms": round(elapsed * 1000, 3),
+                    "at_ms": round(at_ms, 3),
+                    "caller": caller,
+                })
+
+    def repeated_queries(self) -> List[Dict[str, Any]]:
+        """同一条语句（参数化后文本相同）重复执行，通常意味着循环里逐条查询。"""
+        groups: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        for q in self.queries:
+            g = groups.get(q["sql"])
+            if g is None:
+                g = groups[q["sql"]] = {"sql": q["sql"], "count": 0, "total_ms": 0.0, "callers": Counter()}
+            g["count"] += 1
+            g["total_ms"] += q["ms"]
+            g["callers"][q["caller"]] += 1
+        flagged = []
+        for g in groups.values():
+            if g["count"] >= REPEAT_THRESHOLD:
+                flagged.append({
+                    "sql": g["sql"],
+                    "count": g["count"],
+                    "total_ms": round(g["total_ms"], 3),
+                    "callers": [c for c, _ in g["callers"].most_common(3)],
+                })
+        flagged.sort(key=lambda g: g["count"], reverse=True)
+        return flagged
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3),
+            "query_count": self.query_count,
+            "query_ms": round(self.query_ms, 3),
+            "repeated_query_count": len(self.repeated_queries()),
+            "forced": self.forced,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = self.summary()
+        d["repeated_queries"] = self.repeated_queries()
+        d["queries"] = self.queries
+        d["sample_interval_ms"] = SAMPLE_MS
+        # 采样线程可能仍在写入，读取时同样持锁
+        with self._lock:
+            d["sample_count"] = self.sample_count
+            stacks = self.samples.most_common()
+        # 折叠栈格式（外层;...;内层），可直接喂给 flamegraph 工具
+        d["stacks"] = [{"stack": s, "count": n} for s, n in stacks]
+        return d
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("mcp_profile", default=None)
+
+# ------------------------------
+# Storage
+# ------------------------------
+_store_lock = threading.Lock()
+_store: "OrderedDict[str, RequestProfile]" = OrderedDict()
+
+# _save 在中间件里（事件循环上）调用；写文件交给后台线程，避免大剖析结果阻塞整个服务
+_write_queue: "queue.Queue[RequestProfile]" = queue.Queue()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+def _write_loop():
+    while True:
+        p = _write_queue.get()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f"{p.id}.json"), "w", encoding="utf-8") as f:
+                json.dump(p.to_dict(), f, ensure_ascii=False, indent=2)
+        except OSError:
+            pass
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="mcp-profile-writer", daemon=True)
+            _writer.start()
+
+def _save(p: RequestProfile):
+    with _store_lock:
+        _store[p.id] = p
+        while len(_store) > KEEP:
+            _store.popitem(last=False)
+    if PROFILE_DIR:
+        _ensure_writer()
+        _write_queue.put(p)
+
+def list_profiles() -> List[Dict[str, Any]]:
+    with _store_lock:
+        items = list(_store.values())
+    return [p.summary() for p in reversed(items)]
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    with _store_lock:
+        p = _store.get(profile_id)
+    return p.to_dict() if p else None
+
+# ------------------------------
+# Stack sampler
+# ------------------------------
+_active_lock = threading.Lock()
+_active: Set[RequestProfile] = set()
+_sampler: Optional[threading.Thread] = None
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+def _sample_loop():
+    interval = SAMPLE_MS / 1000
+    while True:
+        time.sleep(interval)
+        with _active_lock:
+            active = [p for p in _active if p.threads]
+        if not active:
+            continue
+        frames = sys._current_frames()
+        for p in active:
+            for ident in list(p.threads):
+                f = frames.get(ident)
+                if f is not None:
+                    stack = _fold(f)
+                    with p._lock:
+                        p.samples[stack] += 1
+                        p.sample_count += 1
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = threading.Thread(target=_sample_loop, name="mcp-profiler", daemon=True)
+        _sampler.start()
+
+# ------------------------------
+# Hooks
+# ------------------------------
+def _caller() -> str:
+    f = sys._getframe(2)
+    while f is not None:
+        fn = f.f_code.co_filename
+        if fn.startswith(_APP_DIR) and fn not in _SKIP_FILES:
+            return f"{os.path.basename(fn)}:{f.f_code.co_name}:{f.f_lineno}"
+        f = f.f_back
+    return ""
+
+def install_sql_hooks(engine):
+    if not ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("mcp_profile_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("mcp_profile_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        p = _current.get()
+        if p is not None:
+            p.add_query(statement, elapsed, _caller())
+
+def _bind_thread(endpoint):
+    """包一层路由函数：记录其执行线程，供采样线程读取调用栈。"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            p = _current.get()
+            ident = threading.get_ident()
+            if p is not None:
+                p.threads.add(ident)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                if p is not None:
+                    p.threads.discard(ident)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            p = _current.get()
+            ident = threading.get_ident()
+            if p is not None:
+                p.threads.add(ident)
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                if p is not None:
+                    p.threads.discard(ident)
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        if ENABLED:
+            endpoint = _bind_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith("/api/admin/profiles"):
+            await self.app(scope, receive, send)
+            return
+
+        forced = any(k == b"x-profile" and v not in (b"", b"0") for k, v in scope.get("headers", []))
+        p = RequestProfile(scope.get("method", ""), scope.get("path", ""), forced)
+        token = _current.set(p)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                p.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", p.id.encode())]
+            await send(message)
+
+        _ensure_sampler()
+        with _active_lock:
+            _active.add(p)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            with _active_lock:
+                _active.discard(p)
+            _current.reset(token)
+            p.duration_ms = (time.perf_counter() - p.start) * 1000
+            route = scope.get("route")
+            p.route = getattr(route, "path", "") or ""
+            if p.forced or p.duration_ms >= SLOW_MS or p.repeated_queries():
+                _save(p)
@@ -0,0 +1,150 @@
+"""
+节点位置的均匀网格索引，用于按视口（bbox）返回部分图。
+
+每个场景一份索引，按图版本缓存在内存中；保存/导入时重建，查询时若版本不符则惰性重建。
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import math, threading
+
+CELL = 512.0          # 网格边长（画布坐标）
+NODE_SIZE = 120.0     # iconNode 的默认尺寸，position 为左上角
+LOD_GRID = 16         # 视口外节点按 16x16 粗网格聚合
+
+class SpatialIndex:
+    def __init__(self, graph: Dict[str, Any]):
+        self.nodes: List[Dict[str, Any]] = graph.get("nodes", []) or []
+        self.edges: List[Dict[str, Any]] = graph.get("edges", []) or []
+        self.meta: Dict[str, Any] = graph.get("meta", {}) or {}
+        self._xy: List[Tuple[float, float]] = []
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._by_id: Dict[str, int] = {}
+        self._incident: Dict[str, List[int]] = {}
+
+        for i, n in enumerate(self.nodes):
+            p = n.get("position") or {}
+            x, y = p.get("x", 0), p.get("y", 0)
+            x = float(x) if isinstance(x, (int, float)) and math.isfinite(x) else 0.0
+            y = float(y) if isinstance(y, (int, float)) and math.isfinite(y) else 0.0
+            self._xy.append((x, y))
+            self._by_id[str(n.get("id"))] = i
+            self._grid.setdefault((math.floor(x / CELL), math.floor(y / CELL)), []).append(i)
+        for j, e in enumerate(self.edges):
+            for end in (e.get("source"), e.get("target")):
+                self._incident.setdefault(str(end), []).append(j)
+
+        if self._xy:
+            xs = [p[0] for p in self._xy]
+            ys = [p[1] for p in self._xy]
+            self.bounds = (min(xs), min(ys), max(xs) + NODE_SIZE, max(ys) + NODE_SIZE)
+        else:
+            self.bounds = (0.0, 0.0, 0.0, 0.0)
+        # 已占用网格的范围，查询时把 bbox 的网格区间收敛到这里
+        if self._grid:
+            self._cells = (min(k[0] for k in self._grid), min(k[1] for k in self._grid),
+                           max(k[0] for k in self._grid), max(k[1] for k in self._grid))
+        else:
+            self._cells = (0, 0, -1, -1)
+
+        # 全部节点的粗网格计数；查询时只减去已返回的节点
+        bx0, by0, bx1, by1 = self.bounds
+        self._lod_size = max(bx1 - bx0, by1 - by0, CELL) / LOD_GRID
+        self._lod_key: List[Tuple[int, int]] = []
+        self._lod_counts: Dict[Tuple[int, int], int] = {}
+        for x, y in self._xy:
+            key = (int((x - bx0) // self._lod_size), int((y - by0) // self._lod_size))
+            self._lod_key.append(key)
+            self._lod_counts[key] = self._lod_counts.get(key, 0) + 1
+
+    def query(self, x0: float, y0: float, x1: float, y1: float) -> Dict[str, Any]:
+        """返回与 bbox 相交的节点、它们的关联边（连同边另一端的节点），以及其余节点的粗粒度聚合。"""
+        if x0 > x1:
+            x0, x1 = x1, x0
+        if y0 > y1:
+            y0, y1 = y1, y0
+        # 节点以左上角定位，向左上扩展一个节点尺寸以包含部分可见的节点
+        qx0, qy0 = x0 - NODE_SIZE, y0 - NODE_SIZE
+        ox0, oy0, ox1, oy1 = self._cells
+        cx0, cx1 = max(math.floor(qx0 / CELL), ox0), min(math.floor(x1 / CELL), ox1)
+        cy0, cy1 = max(math.floor(qy0 / CELL), oy0), min(math.floor(y1 / CELL), oy1)
+        if cx0 > cx1 or cy0 > cy1:
+            cells = []
+        elif (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._grid):
+            # 区间内的格子比已占用的格子还多，直接遍历已占用的格子
+            cells = [v for (cx, cy), v in self._grid.items() if cx0 <= cx <= cx1 and cy0 <= cy <= cy1]
+        else:
+            cells = [self._grid.get((cx, cy), ()) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+        inside: List[int] = []
+        for cell in cells:
+            for i in cell:
+                x, y = self._xy[i]
+                if qx0 <= x <= x1 and qy0 <= y <= y1:
+                    inside.append(i)
+        inside.sort()
+        inside_set = set(inside)
+
+        edge_idx = set()
+        for i in inside:
+            edge_idx.update(self._incident.get(str(self.nodes[i].get("id")), ()))
+        edges = [self.edges[j] for j in sorted(edge_idx)]
+
+        # 关联边另一端在视口外的节点也一并返回，否则客户端无法画出这些边
+        extra = set()
+        for e in edges:
+            for end in (e.get("source"), e.get("target")):
+                k = self._by_id.get(str(end))
+                if k is not None and k not in inside_set:
+                    extra.add(k)
+        returned = inside_set | extra
+        nodes = [self.nodes[i] for i in sorted(returned)]
+
+        return {
+            "nodes": nodes,
+            "edges": edges,
+            "meta": self.meta,
+            "partial": True,
+            "bbox": [x0, y0, x1, y1],
+            "bounds": list(self.bounds),
+            "total_nodes": len(self.nodes),
+            "total_edges": len(self.edges),
+            "lod": self._lod(returned),
+        }
+
+    def _lod(self, exclude: set) -> List[Dict[str, Any]]:
+        """未返回的节点按粗网格聚合成 {x, y, w, h, count}，供客户端画占位/小地图。"""
+        bx0, by0 = self.bounds[0], self.bounds[1]
+        size = self._lod_size
+        buckets = dict(self._lod_counts)
+        for i in exclude:
+            buckets[self._lod_key[i]] -= 1
+        return [
+            {"x": bx0 + gx * size, "y": by0 + gy * size, "w": size, "h": size, "count": n}
+            for (gx, gy), n in sorted(buckets.items()) if n
+        ]
+
+class SpatialIndexCache:
+    """scene_id -> (图版本键, 索引) 的小型 LRU。"""
+
+    def __init__(self, size: int = 16):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[int, Tuple[Any, SpatialIndex]]" = OrderedDict()
+
+    def get(self, scene_id: int, key: Any) -> Optional[SpatialIndex]:
+        with self._lock:
+            hit = self._items.get(scene_id)
+            if hit is None or hit[0] != key:
+                return None
+            self._items.move_to_end(scene_id)
+            return hit[1]
+
+    def put(self, scene_id: int, key: Any, index: SpatialIndex):
+        with self._lock:
+            self._items[scene_id] = (key, index)
+            self._items.move_to_end(scene_id)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def drop(self, scene_id: int):
+        with self._lock:
+            self._items.pop(scene_id, None)
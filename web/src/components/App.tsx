@@ -37,8 +37,9 @@ export default function App() {
     console.log('SAVE_PAYLOAD_SAMPLE_NODE', g.nodes?.[0]) // 随便看第一个节点
     setPending(true)
     try {
-      const res = await saveGraph(sceneId, g)
-      setGraph(res)
+      // 服务端返回的是压缩后的图（去掉了运行时字段和 detailNode），画布已是最新状态，
+      // 不再回填 initialGraph，否则会整体替换节点并清空撤销历史与选中状态
+      await saveGraph(sceneId, g)
     } finally {
       setPending(false)
     }
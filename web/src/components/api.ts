@@ -69,6 +69,15 @@ export async function getGraph(sceneId: number) {
   return data
 }
 
+/**
+ * 只取视口内的节点（及其关联边），其余部分以 lod 聚合返回；
+ * bbox 为画布坐标 [x0, y0, x1, y1]
+ */
+export async function getGraphViewport(sceneId: number, bbox: [number, number, number, number]) {
+  const { data } = await api.get(`/api/scenes/${sceneId}/graph`, { params: { bbox: bbox.join(',') } })
+  return data
+}
+
 export async function saveGraph(sceneId: number, payload: any) {
   const { data } = await api.put(`/api/scenes/${sceneId}/graph`, payload)
   return data
@@ -123,4 +132,41 @@ export async function importSceneZip(file: File): Promise<{ ok: boolean; scene_i
     headers: { 'Content-Type': 'multipart/form-data' },
   })
   return data
-}
\ No newline at end of file
+}
+
+// ========== Background jobs（大场景导出/导入） ==========
+export interface Job {
+  id: string
+  kind: 'export_scene' | 'import_scene'
+  status: 'queued' | 'running' | 'done' | 'failed'
+  scene_id?: number | null
+  items_done: number
+  items_total: number
+  bytes_written: number
+  result_scene_id?: number | null
+  error: string
+}
+
+export async function submitExportJob(sceneId: number): Promise<Job> {
+  const { data } = await api.post(`/api/jobs/export/scene/${sceneId}`)
+  return data
+}
+
+export async function submitImportJob(file: File): Promise<Job> {
+  const form = new FormData()
+  form.append('file', file)
+  const { data } = await api.post('/api/jobs/import/scene', form, {
+    headers: { 'Content-Type': 'multipart/form-data' },
+  })
+  return data
+}
+
+export async function getJob(id: string): Promise<Job> {
+  const { data } = await api.get(`/api/jobs/${id}`)
+  return data
+}
+
+export async function downloadJobResult(id: string): Promise<Blob> {
+  const res = await api.get(`/api/jobs/${id}/result`, { responseType: 'blob' })
+  return res.data
+}